@@ -3,10 +3,14 @@ Second-hand Marketplace
 author: Haomeng DU, also Hugh Declan
 """
 
-from typing import Dict, List, Tuple, Optional, Callable
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Callable
+from functools import lru_cache
+from itertools import chain
+import atexit
 import csv
 import os
 import random
+import sys
 
 # ------------------------ Constants ------------------------
 
@@ -17,6 +21,15 @@ USERS_CSV = os.path.join(DATA_DIR, "users.csv")
 ITEMS_CSV = os.path.join(DATA_DIR, "items.csv")
 LISTINGS_CSV = os.path.join(DATA_DIR, "listings.csv")
 ORDERS_CSV = os.path.join(DATA_DIR, "orders.csv")
+# the four table names, used to track unsaved changes per table
+TABLES = ("users", "items", "listings", "orders")
+# 6-digit numeric ids are drawn without repeats, ID_POOL_SIZE at a time
+ID_RANGE = range(100000, 1000000)
+ID_POOL_SIZE = 1024
+# buffer size for reading and rewriting whole CSV files, fewer read/write syscalls on big tables
+IO_BUFFER_SIZE = 1 << 20
+# a table is rewritten in full once its superseded rows exceed this share of the table
+COMPACT_RATIO = 0.25
 
 # eight categories to use check and search(by category)
 CATEGORIES = [
@@ -37,6 +50,11 @@ CONDITIONS = [
     "GOOD",
     "ACCEPTABLE"
 ]
+# sets for the validity checks, and the prompts listing the choices, built once
+CATEGORY_SET = frozenset(CATEGORIES)
+CONDITION_SET = frozenset(CONDITIONS)
+CATEGORY_PROMPT = f"Category {CATEGORIES}"
+CONDITION_PROMPT = f"Condition {CONDITIONS}"
 # different categories have different baseline to give the price recommendation
 CATEGORY_BASELINE = {
     "Electronics": 300.0,
@@ -56,10 +74,15 @@ CONDITION_MULTIPLIER = {
     "GOOD": 0.65,
     "ACCEPTABLE": 0.50,
 }
+# strings accepted as booleans, in the spellings a CSV file is likely to contain
+BOOL_MAP: Dict[str, bool] = {
+    **dict.fromkeys(("True", "true", "TRUE", "1", "yes", "Yes", "YES", "y", "Y"), True),
+    **dict.fromkeys(("False", "false", "FALSE", "0", "no", "No", "NO", "n", "N", ""), False),
+}
 # use this set to store the str used to get back from function
-BACK_TOKENS = {
+BACK_TOKENS = frozenset({
     "cd .."
-}
+})
 
 # ------------------------ Tools ------------------------
 
@@ -67,10 +90,9 @@ BACK_TOKENS = {
 '''
 ensure_dirs(): to ensure the existence of a data directoru
 ensure_csv(): to ensure the existence of csv files
+ends_with_newline(): to check if a file ends with a line break before appending
 title_case(): to reformat the str into capitalisation
 parse_bool(): to parse the input (like "true", "1", "yes", "y") into boolean (True of False)
-bool_str(): to change the boolean True or False to string "True" or "False"
-generate_id(): to generate a unique id for users, listings, orders, and so on
 is_back(): to check if a user is wanna go back
 prompt_loop_back(): envelop the input into standard value or None
 prompt_text(): to prompt the user to input a string
@@ -90,14 +112,30 @@ def ensure_dirs() -> None:
 def ensure_csv(path: str, headers: List[str]) -> None:
     """
     Ensure CSV exists with given headers; if missing, create with header.
-    If the header does not exist, create a header for the CSV file.
+    If the header does not exist (empty file), create a header for the CSV file.
     """
-    if not os.path.exists(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
         with open(path, "w", newline="", encoding="utf-8") as f:
             writer = csv.DictWriter(f, fieldnames=headers)
             writer.writeheader()
 
-# to reformat the str into capitalisation
+# to check if a file ends with a line break,
+# so appended rows do not run into the last row of the file
+def ends_with_newline(path: str) -> bool:
+    """
+    Check if a non-empty file ends with a line break.
+    An empty file counts as ending with one.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) in (b"\n", b"\r")
+
+# to reformat the str into capitalisation,
+# cached since the same categories, usernames and names come back again and again
+@lru_cache(maxsize=4096)
 def title_case(string: str) -> str:
     """
     Normalise to capitalisation for storage or display.
@@ -109,24 +147,7 @@ def parse_bool(string: str) -> bool:
     """
     Parse the input (like "true", "1", "yes", "y") into boolean (True of False).
     """
-    return str(string).strip().lower() in ("true", "1", "yes", "y")
-
-# to change the boolean True or False to string "True" or "False"
-def bool_str(boolean: bool) -> str:
-    """
-    Convert the boolean type into string type.
-    """
-    return "True" if boolean else "False"
-
-# to generate a unique id for users, listings, orders, and so on
-def generate_id(existing: Dict[str, object]) -> str:
-    """
-    Generate a 6-digit numeric ID unique within a table.
-    """
-    while True:
-        value = str(random.randint(100000, 999999))
-        if value not in existing:
-            return value
+    return BOOL_MAP.get(str(string).strip().lower(), False)
 
 # to check if a user is wanna go back,
 # i.e. input the str "cd .." to indicate back
@@ -145,8 +166,9 @@ def prompt_loop_back(
     Prompt with validation.
     Type 'cd ..' to go back.
     """
+    prompt = f"{prompt_hint} (type 'cd ..' to go back): "
     while True:
-        string = input(f"{prompt_hint} (type 'cd ..' to go back): ").strip()
+        string = input(prompt).strip()
         if is_back(string):
             return None
         norm = validator(string)
@@ -162,8 +184,9 @@ def prompt_text(
     Prompt text input.
     Type 'cd ..' to cancel or return.
     """
+    prompt = f"{label} (type 'cd ..' to go back): "
     while True:
-        string = input(f"{label} (type 'cd ..' to go back): ").strip()
+        string = input(prompt).strip()
         if is_back(string):
             return None
         if string or allow_empty:
@@ -186,10 +209,11 @@ def prompt_float(
         min_val: float type, optional,
             if designated, then it would be the minimum value to return if input is greater than to this value.
     """
+    disp = f" [default {default_val:.2f}]" \
+        if default_val is not None else ""
+    prompt = f"{label}{disp} (Enter=accept, 'cd ..'=back): "
     while True:
-        disp = f" [default {default_val:.2f}]" \
-            if default_val is not None else ""
-        string = input(f"{label}{disp} (Enter=accept, 'cd ..'=back): ").strip()
+        string = input(prompt).strip()
         if is_back(string):
             return None
         if string == "" and default_val is not None:
@@ -213,8 +237,9 @@ def prompt_int(
     Prompt integer input.
     Type 'cd ..' to cancel or return.
     """
+    prompt = f"{label} ('cd ..' to go back): "
     while True:
-        string = input(f"{label} ('cd ..' to go back): ").strip()
+        string = input(prompt).strip()
         if is_back(string):
             return None
         try:
@@ -235,6 +260,20 @@ class User:
     """
     User entity.
     """
+    # no per-instance __dict__, one object is kept in memory per CSV row
+    __slots__ = (
+        "id",
+        "username",
+        "password"
+    )
+
+    # CSV columns of the table, in the order of to_row_tuple()
+    HEADERS = (
+        "user_id",
+        "username",
+        "password"
+    )
+
     def __init__(
             self,
             user_id: str,
@@ -248,32 +287,51 @@ class User:
     # convert value of class User's attributes
     # into a dictionary for write to CSV file
     def to_row(self) -> dict:
-        return {
-            "user_id": self.id,
-            "username": self.username,
-            "password": self.password,
-        }
+        return dict(zip(self.HEADERS, self.to_row_tuple()))
+
+    # convert value of class User's attributes
+    # into a tuple in header order for write to CSV file
+    def to_row_tuple(self) -> tuple:
+        return (
+            self.id,
+            self.username,
+            self.password
+        )
 
 # get the users.csv table attributes list
 def user_headers() -> List[str]:
-    return [
-        "user_id",
-        "username",
-        "password"
-    ]
+    return list(User.HEADERS)
 
-# get a record from users.csv as a dictionary
-def user_from_row(row: dict) -> User:
+# get a record from users.csv as a list in header order
+def user_from_row(row: List[str]) -> User:
     return User(
-        user_id= row["user_id"],
-        username = row["username"],
-        password = row["password"]
+        user_id= row[0],
+        username = row[1],
+        password = row[2]
     )
 
 class Item:
     """
     Item entity.
     """
+    __slots__ = (
+        "id",
+        "name",
+        "category",
+        "brand",
+        "condition",
+        "description"
+    )
+
+    HEADERS = (
+        "item_id",
+        "name",
+        "category",
+        "brand",
+        "condition",
+        "description"
+    )
+
     def __init__(
             self,
             item_id: str,
@@ -291,39 +349,58 @@ class Item:
         self.description = description
 
     def to_row(self) -> dict:
-        return {
-            "item_id": self.id,
-            "name": self.name,
-            "category": self.category,
-            "brand": self.brand,
-            "condition": self.condition,
-            "description": self.description
-        }
+        return dict(zip(self.HEADERS, self.to_row_tuple()))
+
+    def to_row_tuple(self) -> tuple:
+        return (
+            self.id,
+            self.name,
+            self.category,
+            self.brand,
+            self.condition,
+            self.description
+        )
 
 def item_headers() -> List[str]:
-    return [
-        "item_id",
-        "name",
-        "category",
-        "brand",
-        "condition",
-        "description"
-    ]
+    return list(Item.HEADERS)
 
-def item_from_row(row: dict) -> Item:
+# category, brand and condition repeat across many items,
+# interning them makes all items share one string object per value
+def item_from_row(row: List[str]) -> Item:
     return Item(
-        item_id= row["item_id"],
-        name = row["name"],
-        category = row["category"],
-        brand = row["brand"],
-        condition = row["condition"],
-        description = row["description"],
+        item_id= row[0],
+        name = row[1],
+        category = sys.intern(row[2]),
+        brand = sys.intern(row[3]),
+        condition = sys.intern(row[4]),
+        description = row[5],
     )
 
 class Listing:
     """
     Listing entity.
     """
+    __slots__ = (
+        "id",
+        "item_id",
+        "seller_id",
+        "price",
+        "quantity",
+        "active",
+        "deleted",
+        "status"
+    )
+
+    HEADERS = (
+        "listing_id",
+        "item_id",
+        "seller_id",
+        "price",
+        "quantity",
+        "active",
+        "deleted"
+    )
+
     def __init__(
             self,
             listing_id: str,
@@ -337,52 +414,92 @@ class Listing:
         self.id = listing_id
         self.item_id = item_id
         self.seller_id = seller_id
-        self.price = float(price)
-        self.quantity = int(quantity)
-        self.active = bool(active)
-        self.deleted = bool(deleted)
+        # values are stored as given, the callers pass them already converted
+        # (listing_from_row parses the CSV strings), no second conversion per row
+        self.price = price
+        self.quantity = quantity
+        self.active = active
+        self.deleted = deleted
+        self.update_status()
+
+    # work out the status once, not on every display;
+    # call again after changing deleted, quantity or active
+    def update_status(self) -> None:
+        """
+        Set status according to deleted, quantity and active.
+        """
+        if self.deleted:
+            self.status = "DELETED"
+        elif self.quantity <= 0:
+            self.status = "SOLD_OUT"
+        elif not self.active:
+            self.status = "INACTIVE"
+        else:
+            self.status = "ACTIVE"
 
     def to_row(self) -> dict:
-        return {
-            "listing_id": self.id,
-            "item_id": self.item_id,
-            "seller_id": self.seller_id,
-            "price": f"{self.price:.2f}",
-            "quantity": str(self.quantity),
-            "active": bool_str(self.active),
-            "deleted": bool_str(self.deleted),
-        }
+        return dict(zip(self.HEADERS, self.to_row_tuple()))
 
-def listing_headers() -> List[str]:
-    return [
-        "listing_id",
-        "item_id",
-        "seller_id",
-        "price",
-        "quantity",
-        "active",
-        "deleted"
-    ]
+    def to_row_tuple(self) -> tuple:
+        return (
+            self.id,
+            self.item_id,
+            self.seller_id,
+            f"{self.price:.2f}",
+            str(self.quantity),
+            "True" if self.active else "False",
+            "True" if self.deleted else "False"
+        )
 
-def listing_from_row(row: dict) -> Listing:
+def listing_headers() -> List[str]:
+    return list(Listing.HEADERS)
+
+def listing_from_row(row: List[str]) -> Listing:
+    # the "True"/"False" written by to_row resolve with a single dict lookup,
+    # any other spelling falls back to parse_bool
+    active = BOOL_MAP.get(row[5])
+    if active is None:
+        active = parse_bool(row[5])
+    deleted = BOOL_MAP.get(row[6])
+    if deleted is None:
+        deleted = parse_bool(row[6])
     return Listing(
-        listing_id= row["listing_id"],
-        item_id = row["item_id"],
-        seller_id = row["seller_id"],
-        # row.get("price", "0") will return the value of key="price" in dictionary row
-        # if the key "price" donot exist, then return "0"
-        # if the value of key="price" is '' or None, row.get() will return it
-        # in this case, row.get("price", "0") or 0 will return 0
-        price = float(row.get("price", "0") or 0),
-        quantity = int(row.get("quantity", "0") or 0),
-        active = parse_bool(row.get("active", "True")),
-        deleted = parse_bool(row.get("deleted", "False")),
+        listing_id= row[0],
+        item_id = row[1],
+        seller_id = row[2],
+        # an empty number field is read as 0
+        price = float(row[3]) if row[3] else 0.0,
+        quantity = int(row[4]) if row[4] else 0,
+        active = active,
+        deleted = deleted,
     )
 
 class Order:
     """
     Order entity.
     """
+    __slots__ = (
+        "id",
+        "buyer_id",
+        "seller_id",
+        "listing_id",
+        "unit_price",
+        "quantity",
+        "total_price",
+        "status"
+    )
+
+    HEADERS = (
+        "order_id",
+        "buyer_id",
+        "seller_id",
+        "listing_id",
+        "unit_price",
+        "quantity",
+        "total_price",
+        "status"
+    )
+
     def __init__(
             self,
             order_id: str,
@@ -398,45 +515,39 @@ class Order:
         self.buyer_id = buyer_id
         self.seller_id = seller_id
         self.listing_id = listing_id
-        self.unit_price = float(unit_price)
-        self.quantity = int(quantity)
-        self.total_price = float(total_price)
+        self.unit_price = unit_price
+        self.quantity = quantity
+        self.total_price = total_price
         self.status = status
 
     def to_row(self) -> dict:
-        return {
-            "order_id": self.id,
-            "buyer_id": self.buyer_id,
-            "seller_id": self.seller_id,
-            "listing_id": self.listing_id,
-            "unit_price": f"{self.unit_price:.2f}",
-            "quantity": str(self.quantity),
-            "total_price": f"{self.total_price:.2f}",
-            "status": self.status
-        }
+        return dict(zip(self.HEADERS, self.to_row_tuple()))
+
+    def to_row_tuple(self) -> tuple:
+        return (
+            self.id,
+            self.buyer_id,
+            self.seller_id,
+            self.listing_id,
+            f"{self.unit_price:.2f}",
+            str(self.quantity),
+            f"{self.total_price:.2f}",
+            self.status
+        )
 
 def order_headers() -> List[str]:
-    return [
-        "order_id",
-        "buyer_id",
-        "seller_id",
-        "listing_id",
-        "unit_price",
-        "quantity",
-        "total_price",
-        "status"
-    ]
+    return list(Order.HEADERS)
 
-def order_from_row(row: dict) -> Order:
+def order_from_row(row: List[str]) -> Order:
     return Order(
-        order_id= row["order_id"],
-        buyer_id = row["buyer_id"],
-        seller_id = row["seller_id"],
-        listing_id = row["listing_id"],
-        unit_price = float(row.get("unit_price", "0") or 0),
-        quantity = int(row.get("quantity", "0") or 0),
-        total_price = float(row.get("total_price", "0") or 0),
-        status = row.get("status", "COMPLETED")
+        order_id= row[0],
+        buyer_id = row[1],
+        seller_id = row[2],
+        listing_id = row[3],
+        unit_price = float(row[4]) if row[4] else 0.0,
+        quantity = int(row[5]) if row[5] else 0,
+        total_price = float(row[6]) if row[6] else 0.0,
+        status = row[7]
     )
 
 # ------------------------ Controller ------------------------
@@ -450,26 +561,92 @@ class Marketplace:
         self.items: Dict[str, Item] = {}
         self.listings: Dict[str, Listing] = {}
         self.orders: Dict[str, Order] = {}
+        # ids of new or changed rows per table, not yet written to CSV
+        # (a dict is used as an insertion-ordered set, so rows are appended in creation order)
+        self._dirty: Dict[str, Dict[str, None]] = {name: {} for name in TABLES}
+        # number of data rows in each CSV file,
+        # rows beyond the size of the table are older copies superseded by a later row
+        self._file_rows: Dict[str, int] = {name: 0 for name in TABLES}
+        # lower-case username -> user id, for login and the duplicate check
+        self.users_by_username: Dict[str, str] = {}
+        # secondary indexes: item category / title-cased item name -> listing ids, in posting order
+        self.by_category: Dict[str, List[str]] = {}
+        self.by_name: Dict[str, List[str]] = {}
+        # seller id -> listing ids, in posting order
+        self.listings_by_seller: Dict[str, List[str]] = {}
+        # listings that can be bought (not deleted, active, in stock), in posting order;
+        # membership is the availability check, so searches never re-test the flags
+        self.active_listings: Dict[str, Listing] = {}
+        # buyer id / seller id -> order ids, in order of purchase
+        self.orders_by_buyer: Dict[str, List[str]] = {}
+        self.orders_by_seller: Dict[str, List[str]] = {}
+        # (category, condition) -> price suggestion, the result only depends on the constants
+        self._price_cache: Dict[Tuple[str, str], Tuple[float, float, float]] = {}
+        # table name -> pre-drawn random ids not handed out yet
+        self._id_pools: Dict[str, Iterator[int]] = {}
 
     # ----- CSV I/O -----
+    def _tables(self) -> Dict[str, Tuple[str, List[str], Dict[str, object]]]:
+        """
+        Map each table name to its CSV path, headers and in-memory table.
+        """
+        return {
+            "users": (USERS_CSV, user_headers(), self.users),
+            "items": (ITEMS_CSV, item_headers(), self.items),
+            "listings": (LISTINGS_CSV, listing_headers(), self.listings),
+            "orders": (ORDERS_CSV, order_headers(), self.orders),
+        }
+
     def _load_csv(
             self,
             path: str,
             headers: List[str],
             dst: Dict[str, object],
-            from_row_func: Callable[[dict], object],
-            id_key: str
-    ):
+            from_row_func: Callable[[List[str]], object]
+    ) -> int:
+        """
+        Load a table from CSV and return the number of rows read.
+        Columns are read by position in header order, the id is the first column.
+        A later row overrides an earlier row with the same id.
+        A file whose header lists the columns in another order is mapped by name
+        and rewritten with the current headers.
+        """
         ensure_csv(path, headers)
         dst.clear()
-        with open(path, "r", newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
+        count = 0
+        with open(
+                path, "r", newline="", encoding="utf-8", buffering=IO_BUFFER_SIZE
+        ) as f:
+            reader = csv.reader(f)
+            file_headers = next(reader, None) or headers
+            # file column of each header, a missing column is read as an empty field
+            columns = None
+            if file_headers != headers:
+                columns = [
+                    file_headers.index(h) if h in file_headers else None
+                    for h in headers
+                ]
+            width = len(file_headers)
             for row in reader:
                 # skip the empty row
-                if not row.get(id_key):
+                if not row:
+                    continue
+                # a row cut short (e.g. an append that was interrupted) is skipped,
+                # it still counts as a file row so the next compaction drops it
+                if len(row) < width:
+                    count += 1
+                    continue
+                if columns is not None:
+                    row = ["" if i is None else row[i] for i in columns]
+                if not row[0]:
                     continue
-                obj = from_row_func(row)
-                dst[row[id_key]] = obj
+                dst[row[0]] = from_row_func(row)
+                count += 1
+        if columns is not None:
+            # rows are appended in header order, so the file has to match it first
+            self._save_csv(path, headers, dst)
+            count = len(dst)
+        return count
 
     def _save_csv(
             self,
@@ -477,73 +654,174 @@ class Marketplace:
             headers: List[str],
             source: Dict[str, object]
     ):
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            for one_object in source.values():
-                writer.writerow(one_object.to_row())
+        with open(
+                path, "w", newline="", encoding="utf-8", buffering=IO_BUFFER_SIZE
+        ) as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            writer.writerows(
+                one_object.to_row_tuple() for one_object in source.values()
+            )
+
+    def _append_csv(
+            self,
+            path: str,
+            headers: List[str],
+            source: Dict[str, object],
+            ids: Dict[str, None]
+    ):
+        """
+        Append the rows of the given ids to the end of the CSV file.
+        """
+        ensure_csv(path, headers)
+        needs_newline = not ends_with_newline(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            if needs_newline:
+                f.write("\n")
+            writer = csv.writer(f)
+            writer.writerows(source[obj_id].to_row_tuple() for obj_id in ids)
+
+    def _mark_dirty(self, table: str, obj_id: str) -> None:
+        """
+        Record that a row was added or changed and has to be written on the next flush.
+        """
+        self._dirty[table][obj_id] = None
 
     def load_all_csv(self) -> None:
         """
         Load all tables from CSV.
+        Changes not written yet are flushed first, the tables are replaced by the files.
         """
+        self.flush()
         ensure_dirs()
-        self._load_csv(
+        self._file_rows["users"] = self._load_csv(
             USERS_CSV,
             user_headers(),
             self.users,
-            user_from_row,
-            "user_id"
+            user_from_row
         )
-        self._load_csv(
+        self._file_rows["items"] = self._load_csv(
             ITEMS_CSV,
             item_headers(),
             self.items,
-            item_from_row,
-            "item_id"
+            item_from_row
         )
-        self._load_csv(
+        self._file_rows["listings"] = self._load_csv(
             LISTINGS_CSV,
             listing_headers(),
             self.listings,
-            listing_from_row,
-            "listing_id"
+            listing_from_row
         )
-        self._load_csv(
+        self._file_rows["orders"] = self._load_csv(
             ORDERS_CSV,
             order_headers(),
             self.orders,
-            order_from_row,
-            "order_id"
+            order_from_row
         )
+        for dirty in self._dirty.values():
+            dirty.clear()
+        self._rebuild_indexes()
 
     def save_all_csv(self) -> None:
         """
-        Save all tables to CSV with current headers.
+        Save all tables to CSV with current headers, rewriting every file in full.
+        The app itself saves through flush(), which only writes changed tables;
+        use this to force a complete rewrite, e.g. after editing the tables in memory.
         """
         ensure_dirs()
-        self._save_csv(
-            USERS_CSV,
-            user_headers(),
-            self.users
-        )
-        self._save_csv(
-            ITEMS_CSV,
-            item_headers(),
-            self.items
-        )
-        self._save_csv(
-            LISTINGS_CSV,
-            listing_headers(),
-            self.listings
-        )
-        self._save_csv(
-            ORDERS_CSV,
-            order_headers(),
-            self.orders
-        )
+        for name, (path, headers, source) in self._tables().items():
+            self._save_csv(path, headers, source)
+            self._dirty[name].clear()
+            self._file_rows[name] = len(source)
 
+    def flush(self, compact: bool = False) -> None:
+        """
+        Write new and changed rows to CSV.
+        Rows are appended, so a change costs one row of I/O instead of a full table rewrite.
+        A table is rewritten in full (compacted) once its superseded rows exceed
+        COMPACT_RATIO of the table, or whenever it has superseded rows if compact is True.
+        main() registers it with atexit to compact on exit.
+        """
+        tables = self._tables()
+        # nothing to write without new rows, or without superseded rows when compacting
+        if not any(
+                self._dirty[name] or (compact and self._file_rows[name] > len(source))
+                for name, (_, _, source) in tables.items()
+        ):
+            return
+        ensure_dirs()
+        for name, (path, headers, source) in tables.items():
+            dirty = self._dirty[name]
+            rows = self._file_rows[name] + len(dirty)
+            stale = rows - len(source)
+            if stale > 0 and (compact or stale > len(source) * COMPACT_RATIO):
+                self._save_csv(path, headers, source)
+                self._file_rows[name] = len(source)
+            elif dirty:
+                self._append_csv(path, headers, source, dirty)
+                self._file_rows[name] = rows
+            dirty.clear()
+
+    # ----- Indexes -----
+    def _rebuild_indexes(self) -> None:
+        """
+        Rebuild the user, listing and order indexes from the loaded tables.
+        """
+        self.users_by_username = {
+            user.username.lower(): user.id for user in self.users.values()
+        }
+        self.by_category.clear()
+        self.by_name.clear()
+        self.listings_by_seller.clear()
+        self.active_listings.clear()
+        for listing in self.listings.values():
+            self._index_listing(listing)
+        self.orders_by_buyer.clear()
+        self.orders_by_seller.clear()
+        for order in self.orders.values():
+            self._index_order(order)
+
+    def _index_listing(self, listing: Listing) -> None:
+        """
+        Add a listing to the category, name, seller and active indexes.
+        """
+        # a listing whose item row is missing cannot be searched by category or name
+        item = self.items.get(listing.item_id)
+        if item is not None:
+            self.by_category.setdefault(item.category, []).append(listing.id)
+            # the name is normalised the same way as the search input,
+            # so names that were not stored in title case (e.g. edited CSV files) are found too
+            self.by_name.setdefault(title_case(item.name), []).append(listing.id)
+        self.listings_by_seller.setdefault(listing.seller_id, []).append(listing.id)
+        # the cached status is "ACTIVE" exactly when the listing is
+        # not deleted, active and in stock, one comparison instead of three checks
+        if listing.status == "ACTIVE":
+            self.active_listings[listing.id] = listing
+
+    def _index_order(self, order: Order) -> None:
+        """
+        Add an order to the buyer and seller indexes.
+        """
+        self.orders_by_buyer.setdefault(order.buyer_id, []).append(order.id)
+        self.orders_by_seller.setdefault(order.seller_id, []).append(order.id)
 
+    # ----- IDs -----
+    def _next_id(self, table: str, existing: Dict[str, object]) -> str:
+        """
+        Generate a 6-digit numeric ID unique within a table.
+        IDs are drawn in batches of distinct numbers, so no retry loop is needed
+        unless an ID is already taken by a loaded row.
+        """
+        pool = self._id_pools.get(table)
+        while True:
+            value = next(pool, None) if pool is not None else None
+            if value is None:
+                pool = iter(random.sample(ID_RANGE, ID_POOL_SIZE))
+                self._id_pools[table] = pool
+                continue
+            value = str(value)
+            if value not in existing:
+                return value
 
     # ----- Operations -----
 
@@ -554,20 +832,18 @@ class Marketplace:
     ) -> User:
         """
         Register a new user.
-        Autosave.
+        Saved to CSV on the next flush().
         """
         user_name = title_case(username)
         if not user_name or not password:
             raise ValueError("Username and password cannot be empty.")
-        if any(
-                u.username.lower() == user_name.lower()
-                for u in self.users.values()
-        ):
+        if user_name.lower() in self.users_by_username:
             raise ValueError("Username already exists.")
-        user_id = generate_id(self.users)
+        user_id = self._next_id("users", self.users)
         user = User(user_id= user_id, username = user_name, password = password)
         self.users[user.id] = user
-        self.save_all_csv()
+        self.users_by_username[user_name.lower()] = user.id
+        self._mark_dirty("users", user.id)
         return user
 
     def login(
@@ -578,10 +854,10 @@ class Marketplace:
         """
         Login by username and password.
         """
-        uname = title_case(username)
-        for user in self.users.values():
-            if user.username == uname and user.password == password:
-                return user
+        user_id = self.users_by_username.get(title_case(username).lower())
+        user = self.users.get(user_id) if user_id else None
+        if user and user.password == password:
+            return user
         return None
 
     def post_listing(
@@ -598,29 +874,29 @@ class Marketplace:
         """
         Post a new listing.
         Creates Item and Listing.
-        Autosave.
+        Saved to CSV on the next flush().
         """
         category = title_case(category)
         cond_up = condition.strip().upper()
-        if category not in CATEGORIES:
+        if category not in CATEGORY_SET:
             raise ValueError("Unknown category.")
-        if cond_up not in CONDITIONS:
+        if cond_up not in CONDITION_SET:
             raise ValueError("Unknown condition.")
         if price <= 0 or quantity <= 0:
             raise ValueError("Price and quantity must be positive.")
 
-        item_id = generate_id(self.items)
+        item_id = self._next_id("items", self.items)
         item = Item(
             item_id= item_id,
             name = title_case(name),
-            category = category,
-            brand = title_case(brand),
-            condition = cond_up,
+            category = sys.intern(category),
+            brand = sys.intern(title_case(brand)),
+            condition = sys.intern(cond_up),
             description = title_case(description)
         )
         self.items[item.id] = item
 
-        listing_id = generate_id(self.listings)
+        listing_id = self._next_id("listings", self.listings)
         listing = Listing(
             listing_id= listing_id,
             item_id = item.id,
@@ -631,7 +907,9 @@ class Marketplace:
             deleted = False
         )
         self.listings[listing.id] = listing
-        self.save_all_csv()
+        self._index_listing(listing)
+        self._mark_dirty("items", item.id)
+        self._mark_dirty("listings", listing.id)
         return listing
 
     def delete_listing(
@@ -642,7 +920,7 @@ class Marketplace:
         """
         Soft delete a listing.
         Mark deleted = True and active = False.
-        Autosave.
+        Saved to CSV on the next flush().
         """
         if listing_id not in self.listings:
             raise ValueError("Listing not found.")
@@ -651,41 +929,33 @@ class Marketplace:
             raise ValueError("You can only delete your own listings.")
         listing.deleted = True
         listing.active = False
-        self.save_all_csv()
+        listing.update_status()
+        self.active_listings.pop(listing.id, None)
+        self._mark_dirty("listings", listing.id)
+
+    def iter_active(self) -> Iterator[Listing]:
+        """
+        Iterate over active, non-deleted listings in stock, in posting order.
+        """
+        return iter(self.active_listings.values())
 
     def search_by_category(self, category: str) -> List[Listing]:
         """
         Search active listings by category.
         Exclude deleted listings.
         """
-        category = title_case(category)
-        return [
-            listing
-            for listing in self.listings.values()
-            if (
-                    not listing.deleted
-                    and listing.active
-                    and listing.quantity > 0
-                    and self.items[listing.item_id].category == category
-            )
-        ]
+        ids = self.by_category.get(title_case(category), ())
+        active = self.active_listings
+        return [active[listing_id] for listing_id in ids if listing_id in active]
 
     def search_by_full_name(self, full_name: str) -> List[Listing]:
         """
-        Search active listings by exact full name.
+        Search active listings by exact full name, compared in title case.
         Exclude deleted listings.
         """
-        target = title_case(full_name)
-        return [
-            listing
-            for listing in self.listings.values()
-            if (
-                    not listing.deleted
-                    and listing.active
-                    and listing.quantity > 0
-                    and self.items[listing.item_id].name == target
-            )
-        ]
+        ids = self.by_name.get(title_case(full_name), ())
+        active = self.active_listings
+        return [active[listing_id] for listing_id in ids if listing_id in active]
 
     def price_suggestion(
             self,
@@ -695,22 +965,28 @@ class Marketplace:
         """
         Price suggestion: suggestion_price = category baseline × condition multiplier.
         return: tuple(suggestion_price, suggestion_price * 0.9, suggestion_price * 1.1)
+        Computed once per (category, condition) and cached.
         """
-        category = title_case(category)
+        key = (title_case(category), condition.strip().upper())
+        cached = self._price_cache.get(key)
+        if cached is not None:
+            return cached
         baseline = CATEGORY_BASELINE.get(
-            category,
+            key[0],
             CATEGORY_BASELINE["Others"]
         )
         multiplier = CONDITION_MULTIPLIER.get(
-            condition.strip().upper(),
+            key[1],
             0.65
         )
         suggestion_price = round(baseline * multiplier, 2)
-        return (
+        result = (
             suggestion_price,
             round(suggestion_price * 0.9, 2),
             round(suggestion_price * 1.1, 2)
         )
+        self._price_cache[key] = result
+        return result
 
     def buy_listing(
             self,
@@ -720,7 +996,7 @@ class Marketplace:
     ) -> Order:
         """
         Create an order and decrease stock.
-        Autosave.
+        Saved to CSV on the next flush().
         """
         if listing_id not in self.listings:
             raise ValueError("Listing not found.")
@@ -733,112 +1009,136 @@ class Marketplace:
             raise ValueError("Listing not available.")
         if quantity <= 0 or quantity > listing.quantity:
             raise ValueError("Invalid quantity.")
-        order_id = generate_id(self.orders)
+        order_id = self._next_id("orders", self.orders)
         order = Order(
             order_id= order_id,
             buyer_id = buyer.id,
             seller_id = listing.seller_id,
             listing_id = listing.id,
             unit_price = listing.price,
-            quantity = quantity,
+            quantity = int(quantity),
             total_price = round(listing.price * quantity, 2),
             status = "COMPLETED"
         )
         self.orders[order.id] = order
+        self._index_order(order)
         listing.quantity -= quantity
         if listing.quantity <= 0:
             listing.active = False
-        self.save_all_csv()
+            self.active_listings.pop(listing.id, None)
+        listing.update_status()
+        self._mark_dirty("orders", order.id)
+        self._mark_dirty("listings", listing.id)
         return order
 
 # ------------------------ Client ------------------------
 
+# the menus are built once and printed with a single write each time
+MAIN_MENU = (
+    "\n=== Second-hand Marketplace ===\n"
+    "1) Register\n"
+    "2) Login\n"
+    "3) View all active listings\n"
+    "4) Search by category\n"
+    "5) Search by full name\n"
+    "0) Quit\n"
+)
+USER_MENU_TEMPLATE = (
+    "\n=== Welcome, {} ===\n"
+    "1) Post a new listing\n"
+    "2) All my listings\n"
+    "3) Buy a listing\n"
+    "4) Delete my listing\n"
+    "5) View all active listings\n"
+    "6) My orders (as buyer)\n"
+    "7) Orders for my listings (as seller)\n"
+    "0) Logout\n"
+)
+
 def print_main_menu():
     """
     Print the main menu.
     """
-    print("\n=== Second-hand Marketplace ===")
-    print("1) Register")
-    print("2) Login")
-    print("3) View all active listings")
-    print("4) Search by category")
-    print("5) Search by full name")
-    print("0) Quit")
+    sys.stdout.write(MAIN_MENU)
 
 def print_user_menu(user_name: str):
     """
     Print the user menu.
     """
-    print(f"\n=== Welcome, {user_name} ===")
-    print("1) Post a new listing")
-    print("2) All my listings")
-    print("3) Buy a listing")
-    print("4) Delete my listing")
-    print("5) View all active listings")
-    print("6) My orders (as buyer)")
-    print("7) Orders for my listings (as seller)")
-    print("0) Logout")
+    sys.stdout.write(USER_MENU_TEMPLATE.format(user_name))
 
-def show_listing(market_place: Marketplace, listing: Listing):
+def print_lines(lines: Iterable[str]):
     """
-    Print one listing.
+    Print many lines with a single write instead of one print() per line.
+    """
+    sys.stdout.write("".join(f"{line}\n" for line in lines))
+
+def format_listing(market_place: Marketplace, listing: Listing) -> str:
+    """
+    Return one listing as a line of text.
     """
     item = market_place.items[listing.item_id]
     seller = market_place.users.get(listing.seller_id)
     seller_name = seller.username if seller else "unknown"
-    print(
+    return (
         f"- ID: {listing.id} | Name: {item.name} | "
         f"Brand: {item.brand} | [{item.category}] ({item.condition}) | "
         f"${listing.price:.2f} x{listing.quantity} | seller: {seller_name}"
     )
 
+def show_listing(market_place: Marketplace, listing: Listing):
+    """
+    Print one listing.
+    """
+    print(format_listing(market_place, listing))
+
 def listing_status(listing: Listing) -> str:
     """
     Return status of listing according to its status(deleted, quantity, active).
     """
-    if listing.deleted:
-        return "DELETED"
-    if listing.quantity <= 0:
-        return "SOLD_OUT"
-    if not listing.active:
-        return "INACTIVE"
-    return "ACTIVE"
+    return listing.status
 
-def show_listing_with_status(
+def format_listing_with_status(
         market_place: Marketplace,
         listing: Listing
-):
+) -> str:
     """
-    Print one listing with its status.
+    Return one listing with its status as a line of text.
     """
     item = market_place.items[listing.item_id]
     status = listing_status(listing)
     seller_name = market_place.users.get(listing.seller_id).username \
         if listing.seller_id in market_place.users else "unknown"
-    print(
+    return (
         f"- ID: {listing.id} | Status: {status} | "
         f"Name: {item.name} | Brand: {item.brand} | "
         f"[{item.category}] ({item.condition}) | "
         f"${listing.price:.2f} x{listing.quantity} | seller: {seller_name}"
     )
 
-def list_active_listings(market_place: Marketplace) -> List[Listing]:
+def show_listing_with_status(
+        market_place: Marketplace,
+        listing: Listing
+):
+    """
+    Print one listing with its status.
+    """
+    print(format_listing_with_status(market_place, listing))
+
+def list_active_listings(market_place: Marketplace) -> int:
     """
-    Print and return all active, non-deleted listings.
+    Print all active, non-deleted listings and return how many there are.
     """
-    active = [
-        listing for listing in market_place.listings.values()
-        if not listing.deleted
-           and listing.active
-           and listing.quantity > 0
-    ]
-    if not active:
+    count = len(market_place.active_listings)
+    if not count:
         print("No active listings.")
     else:
-        print(f"{len(active)} active listing(s):")
-        for lis in active:
-            show_listing(market_place, lis)
-    return active
+        print(f"{count} active listing(s):")
+        print_lines(
+            format_listing(market_place, lis)
+            for lis in market_place.iter_active()
+        )
+    return count
 
 def validate_category_input(category: str) -> Optional[str]:
     """
@@ -846,7 +1146,7 @@ def validate_category_input(category: str) -> Optional[str]:
     Return capitalised category if valid.
     """
     cate = title_case(category)
-    if cate in CATEGORIES:
+    if cate in CATEGORY_SET:
         return cate
     print("Unknown category. Available categories are:")
     print(", ".join(CATEGORIES))
@@ -858,14 +1158,14 @@ def validate_condition_input(condition: str) -> Optional[str]:
     Return upper case of condition if valid.
     """
     cond = condition.strip().upper()
-    if cond in CONDITIONS:
+    if cond in CONDITION_SET:
         return cond
     print("Unknown condition. Choose from:", ", ".join(CONDITIONS))
     return None
 
-def show_order(market_place: Marketplace, order: Order):
+def format_order(market_place: Marketplace, order: Order) -> str:
     """
-    Print one order with item name and brand if available.
+    Return one order with item name and brand if available as a line of text.
     """
     lis = market_place.listings.get(order.listing_id)
     it_name, it_brand = "(listing missing)", "-"
@@ -877,41 +1177,345 @@ def show_order(market_place: Marketplace, order: Order):
         if order.buyer_id in market_place.users else "unknown"
     seller = market_place.users.get(order.seller_id).username \
         if order.seller_id in market_place.users else "unknown"
-    print(f"- Order ID: {order.id} | Item: {it_name} | "
-          f"Brand: {it_brand} | Qty: {order.quantity} | "
-          f"Unit: ${order.unit_price:.2f} | Total: ${order.total_price:.2f} | "
-          f"Buyer: {buyer} | Seller: {seller} | Status: {order.status}"
+    return (f"- Order ID: {order.id} | Item: {it_name} | "
+            f"Brand: {it_brand} | Qty: {order.quantity} | "
+            f"Unit: ${order.unit_price:.2f} | Total: ${order.total_price:.2f} | "
+            f"Buyer: {buyer} | Seller: {seller} | Status: {order.status}"
     )
 
+def show_order(market_place: Marketplace, order: Order):
+    """
+    Print one order with item name and brand if available.
+    """
+    print(format_order(market_place, order))
+
 def list_my_purchased_orders(market_place: Marketplace, user: User):
     """
     List the orders that I bought.
     """
-    my_orders = [
-        order for order in market_place.orders.values()
-        if order.buyer_id == user.id
-    ]
-    if not my_orders:
+    order_ids = market_place.orders_by_buyer.get(user.id, ())
+    if not order_ids:
         print("You have no orders as buyer.")
         return
-    print(f"You have {len(my_orders)} order(s) as buyer:")
-    for order in my_orders:
-        show_order(market_place, order)
+    print(f"You have {len(order_ids)} order(s) as buyer:")
+    print_lines(
+        format_order(market_place, market_place.orders[order_id])
+        for order_id in order_ids
+    )
 
 def list_my_sold_orders(market_place: Marketplace, user: User):
     """
     List the orders that I sold.
     """
-    my_orders = [
-        order for order in market_place.orders.values()
-        if order.seller_id == user.id
-    ]
-    if not my_orders:
+    order_ids = market_place.orders_by_seller.get(user.id, ())
+    if not order_ids:
         print("No orders for your listings yet.")
         return
-    print(f"You have {len(my_orders)} order(s) for your listings:")
-    for order in my_orders:
-        show_order(market_place, order)
+    print(f"You have {len(order_ids)} order(s) for your listings:")
+    print_lines(
+        format_order(market_place, market_place.orders[order_id])
+        for order_id in order_ids
+    )
+
+# ------------------------ Commands ------------------------
+
+# every menu command takes the marketplace and the logged-in user (None if not logged in)
+# and returns the logged-in user after the command
+Command = Callable[[Marketplace, Optional[User]], Optional[User]]
+
+def handle_register(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Register a new user.
+    """
+    user_name = prompt_text(
+        "Username (Capitalisation format will be stored): "
+    )
+    if user_name is None:
+        return current_user
+    password = prompt_text("Password: ")
+    if password is None:
+        return current_user
+    try:
+        user = market_place.register(user_name, password)
+        print(f"Registered: {user.username} (User ID: {user.id})")
+    except ValueError as e:
+        print(f"Error: {e}")
+    return current_user
+
+def handle_login(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Login, return the user if username and password match.
+    """
+    user_name = prompt_text("Username: ")
+    if user_name is None:
+        return current_user
+    password = prompt_text("Password: ")
+    if password is None:
+        return current_user
+    user = market_place.login(user_name, password)
+    if user:
+        print(f"Logged in as {user.username}")
+        return user
+    print("Unmatched username and password.")
+    return current_user
+
+def handle_view_listings(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    View all active listings.
+    """
+    list_active_listings(market_place)
+    return current_user
+
+def handle_search_category(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Search active listings by category.
+    """
+    print("Available categories:", ", ".join(CATEGORIES))
+    category = prompt_loop_back(
+        "Category", validate_category_input
+    )
+    if category is None:
+        return current_user
+    results = market_place.search_by_category(category)
+    if not results:
+        print("No listings in this category.")
+    else:
+        print(f"Found {len(results)} listing(s):")
+        print_lines(
+            format_listing(market_place, listing)
+            for listing in results
+        )
+    return current_user
+
+def handle_search_name(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Search active listings by full name.
+    """
+    full_name = prompt_text("Full item item_name (exactly): ")
+    if full_name is None:
+        return current_user
+    results = market_place.search_by_full_name(full_name)
+    if not results:
+        print(f"No listings of {full_name} found.")
+    else:
+        print(f"Found {len(results)} listing(s):")
+        print_lines(
+            format_listing(market_place, listing)
+            for listing in results
+        )
+    return current_user
+
+def handle_post_listing(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Add a listing.
+    """
+    category = prompt_loop_back(
+        CATEGORY_PROMPT, validate_category_input
+    )
+    if category is None:
+        return current_user
+    item_name = prompt_text("Item item_name (full): ")
+    if item_name is None:
+        return current_user
+    condition = prompt_loop_back(
+        CONDITION_PROMPT, validate_condition_input
+    )
+    if condition is None:
+        return current_user
+    brand = prompt_text("Brand: ")
+    if brand is None:
+        return current_user
+    description = prompt_text(
+        "Description (optional, can be empty): ", allow_empty=True
+    )
+    if description is None:
+        return current_user
+    suggest_price, low, high = market_place.price_suggestion(
+        category,
+        condition
+    )
+    print(
+        f"Suggested price: ${suggest_price:.2f} "
+        f"(range ${low:.2f} - ${high:.2f})"
+    )
+    price = prompt_float(
+        "Price",
+        default_val=suggest_price,
+        min_val=0.01
+    )
+    if price is None:
+        return current_user
+    quantity = prompt_int("Quantity", min_val=1)
+    if quantity is None:
+        return current_user
+    try:
+        listing = market_place.post_listing(
+            current_user,
+            item_name,
+            category,
+            brand,
+            condition,
+            description,
+            price, quantity
+        )
+        item = market_place.items[listing.item_id]
+        print(
+            f"Posted listing {listing.id} for {item.name} "
+            f"at ${listing.price:.2f} x{listing.quantity}"
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+    return current_user
+
+def handle_my_listings(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    All my listings (including deleted or sold out).
+    """
+    listings = market_place.listings
+    my_ids = market_place.listings_by_seller.get(current_user.id, ())
+    mine_all = [listings[listing_id] for listing_id in my_ids]
+    if not mine_all:
+        print("You have no listings yet.")
+    else:
+        print(f"All your listings ({len(mine_all)}):")
+        print_lines(
+            format_listing_with_status(market_place, listing)
+            for listing in mine_all
+        )
+    return current_user
+
+def handle_buy_listing(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Buy a listing.
+    """
+    available = list_active_listings(market_place)
+    if not available:
+        return current_user
+    listing_id = prompt_text("Enter Listing ID to buy")
+    if listing_id is None:
+        return current_user
+    quantity = prompt_int("Quantity", min_val=1)
+    if quantity is None:
+        return current_user
+    try:
+        order = market_place.buy_listing(
+            current_user,
+            listing_id,
+            quantity
+        )
+        print(
+            f"Order {order.id} created: ${order.total_price:.2f} "
+            f"for {quantity} unit(s).\nArrange offline payment/delivery."
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+    return current_user
+
+def handle_delete_listing(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Delete my listing.
+    """
+    active = market_place.active_listings
+    my_ids = market_place.listings_by_seller.get(current_user.id, ())
+    # the candidates are only walked once for display,
+    # so peek at the first one for the empty check instead of building a list
+    candidates = (
+        active[listing_id] for listing_id in my_ids if listing_id in active
+    )
+    first = next(candidates, None)
+    if first is None:
+        print("You have no active listings to delete.")
+        return current_user
+    print("Your active listings:")
+    print_lines(
+        format_listing(market_place, listing)
+        for listing in chain((first,), candidates)
+    )
+    listing_id = prompt_text("Listing ID to delete")
+    if listing_id is None:
+        return current_user
+    try:
+        market_place.delete_listing(current_user, listing_id)
+        print("Listing deleted (soft).")
+    except ValueError as e:
+        print(f"Error: {e}")
+    return current_user
+
+def handle_my_purchases(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    My orders (as buyer).
+    """
+    list_my_purchased_orders(market_place, current_user)
+    return current_user
+
+def handle_my_sales(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Orders for my listings (as seller).
+    """
+    list_my_sold_orders(market_place, current_user)
+    return current_user
+
+def handle_logout(
+        market_place: Marketplace,
+        current_user: Optional[User]
+) -> Optional[User]:
+    """
+    Logout.
+    """
+    print("Logged out.")
+    return None
+
+# menu choice -> command, "0" (quit) of the main menu is handled by the main loop
+MAIN_COMMANDS: Dict[str, Command] = {
+    "1": handle_register,
+    "2": handle_login,
+    "3": handle_view_listings,
+    "4": handle_search_category,
+    "5": handle_search_name,
+}
+USER_COMMANDS: Dict[str, Command] = {
+    "1": handle_post_listing,
+    "2": handle_my_listings,
+    "3": handle_buy_listing,
+    "4": handle_delete_listing,
+    "5": handle_view_listings,
+    "6": handle_my_purchases,
+    "7": handle_my_sales,
+    "0": handle_logout,
+}
 
 # ------------------------ Main loop ------------------------
 
@@ -919,6 +1523,8 @@ def main():
     ensure_dirs()
     market_place = Marketplace()
     market_place.load_all_csv()
+    # compact the CSV files once on exit
+    atexit.register(market_place.flush, True)
 
     current_user: Optional[User] = None
 
@@ -926,202 +1532,22 @@ def main():
         if not current_user:
             print_main_menu()
             command = input("Choose: ").strip()
-            if command == "1":
-                user_name = prompt_text(
-                    "Username (Capitalisation format will be stored): "
-                )
-                if user_name is None:
-                    continue
-                password = prompt_text("Password: ")
-                if password is None:
-                    continue
-                try:
-                    user = market_place.register(user_name, password)
-                    print(f"Registered: {user.username} (User ID: {user.id})")
-                except ValueError as e:
-                    print(f"Error: {e}")
-
-            elif command == "2":
-                user_name = prompt_text("Username: ")
-                if user_name is None:
-                    continue
-                password = prompt_text("Password: ")
-                if password is None:
-                    continue
-                user = market_place.login(user_name, password)
-                if user:
-                    current_user = user
-                    print(f"Logged in as {user.username}")
-                else:
-                    print("Unmatched username and password.")
-
-            elif command == "3":
-                list_active_listings(market_place)
-
-            elif command == "4":
-                print("Available categories:", ", ".join(CATEGORIES))
-                category = prompt_loop_back(
-                    "Category", validate_category_input
-                )
-                if category is None:
-                    continue
-                results = market_place.search_by_category(category)
-                if not results:
-                    print("No listings in this category.")
-                else:
-                    print(f"Found {len(results)} listing(s):")
-                    for listing in results:
-                        show_listing(market_place, listing)
-
-            elif command == "5":
-                full_name = prompt_text("Full item item_name (exactly): ")
-                if full_name is None:
-                    continue
-                results = market_place.search_by_full_name(full_name)
-                if not results:
-                    print(f"No listings of {full_name} found.")
-                else:
-                    print(f"Found {len(results)} listing(s):")
-                    for listing in results:
-                        show_listing(market_place, listing)
-
-            elif command == "0":
+            if command == "0":
                 print("Goodbye ~\nSee you later!.")
                 break
-            else:
-                print("Invalid command.")
-
+            commands = MAIN_COMMANDS
         else:
             print_user_menu(current_user.username)
             command = input("Choose: ").strip()
+            commands = USER_COMMANDS
 
-            if command == "1":
-                # Add a listing
-                category = prompt_loop_back(
-                    f"Category {CATEGORIES}", validate_category_input
-                )
-                if category is None:
-                    continue
-                item_name = prompt_text("Item item_name (full): ")
-                if item_name is None:
-                    continue
-                condition = prompt_loop_back(
-                    f"Condition {CONDITIONS}", validate_condition_input
-                )
-                if condition is None:
-                    continue
-                brand = prompt_text("Brand: ")
-                if brand is None:
-                    continue
-                description = prompt_text(
-                    "Description (optional, can be empty): ", allow_empty=True
-                )
-                if description is None:
-                    continue
-                suggest_price, low, high = market_place.price_suggestion(
-                    category,
-                    condition
-                )
-                print(
-                    f"Suggested price: ${suggest_price:.2f} "
-                    f"(range ${low:.2f} - ${high:.2f})"
-                )
-                price = prompt_float(
-                    "Price",
-                    default_val=suggest_price,
-                    min_val=0.01
-                )
-                if price is None:
-                    continue
-                quantity = prompt_int("Quantity", min_val=1)
-                if quantity is None:
-                    continue
-                try:
-                    listing = market_place.post_listing(
-                        current_user,
-                        item_name,
-                        category,
-                        brand,
-                        condition,
-                        description,
-                        price, quantity
-                    )
-                    print(f'''Posted listing {listing.id} for {title_case(item_name)} 
-                    at ${listing.price:.2f} x{listing.quantity}''')
-                except ValueError as e:
-                    print(f"Error: {e}")
-
-            elif command == "2":
-                # All my listings (including deleted or sold out)
-                mine_all = [
-                    listing for listing in market_place.listings.values()
-                    if listing.seller_id == current_user.id
-                ]
-                if not mine_all:
-                    print("You have no listings yet.")
-                else:
-                    print(f"All your listings ({len(mine_all)}):")
-                    for listing in mine_all:
-                        show_listing_with_status(market_place, listing)
-
-            elif command == "3":
-                # Buy a listing
-                available = list_active_listings(market_place)
-                if not available:
-                    continue
-                listing_id = prompt_text("Enter Listing ID to buy")
-                if listing_id is None:
-                    continue
-                quantity = prompt_int("Quantity", min_val=1)
-                if quantity is None:
-                    continue
-                try:
-                    order = market_place.buy_listing(
-                        current_user,
-                        listing_id,
-                        quantity
-                    )
-                    print(f'''Order {order.id} created: ${order.total_price:.2f} 
-                    for {quantity} unit(s). \nArrange offline payment/delivery.''')
-                except ValueError as e:
-                    print(f"Error: {e}")
-
-            elif command == "4":
-                # Delete my listing
-                candidates = [
-                    listing for listing in market_place.listings.values()
-                    if listing.seller_id == current_user.id
-                       and not listing.deleted and listing.active
-                ]
-                if not candidates:
-                    print("You have no active listings to delete.")
-                    continue
-                print("Your active listings:")
-                for listing in candidates:
-                    show_listing(market_place, listing)
-                listing_id = prompt_text("Listing ID to delete")
-                if listing_id is None:
-                    continue
-                try:
-                    market_place.delete_listing(current_user, listing_id)
-                    print("Listing deleted (soft).")
-                except ValueError as e:
-                    print(f"Error: {e}")
-
-            elif command == "5":
-                list_active_listings(market_place)
-
-            elif command == "6":
-                list_my_purchased_orders(market_place, current_user)
-
-            elif command == "7":
-                list_my_sold_orders(market_place, current_user)
-
-            elif command == "0":
-                current_user = None
-                print("Logged out.")
-            else:
-                print("Invalid command.")
+        handler = commands.get(command)
+        if handler is None:
+            print("Invalid command.")
+        else:
+            current_user = handler(market_place, current_user)
+        # write all changes of this menu turn in one go
+        market_place.flush()
 
 if __name__ == "__main__":
     main()